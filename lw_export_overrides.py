@@ -1,13 +1,28 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
-import argparse
-import configparser
+import os
 import re
+import shutil
 from pathlib import Path
-from typing import Iterable, Tuple, Optional, List
+from typing import Any, Dict, Iterable, Iterator, NamedTuple, Tuple, Optional, List
 
-PREF_RE = re.compile(r'^\s*user_pref\("(?P<name>[^"]+)",\s*(?P<value>.+?)\s*\);\s*$')
+try:
+    import re._parser as sre_parse  # type: ignore[import-not-found]  # Python 3.11+
+except ImportError:
+    try:
+        import sre_parse
+    except ImportError:
+        sre_parse = None  # regex_literal_prefix then returns ""
+
+try:  # optional: single-pass multi-pattern prefilter for should_exclude
+    import ahocorasick  # type: ignore[import-not-found]
+except ImportError:
+    ahocorasick = None
+
+# Applied to the whole (newline-normalised) file at once. [^\S\n] is \s minus the newline,
+# so a match never spans lines but accepts the same whitespace as a per-line \s would.
+PREF_RE = re.compile(r'^[^\S\n]*user_pref\("([^"\n]+)",[^\S\n]*(.+?)[^\S\n]*\);[^\S\n]*$', re.M)
 
 # Policy-only, privacy-first exporter.
 # Hard rule: explicit denylist ALWAYS wins over allowlist.
@@ -128,30 +143,92 @@ def candidate_base_dirs() -> List[Path]:
     ]
 
 
-def read_profiles_ini(base_dir: Path) -> configparser.ConfigParser:
+def _parse_profiles_ini(path: Path) -> Dict[str, Dict[str, str]]:
+    """Minimal INI reader: [section] headers and key=value lines, keys lowercased.
+
+    Covers what Firefox writes to profiles.ini. Unlike configparser it ignores
+    "key: value" and continuation lines, and merges duplicate sections instead of
+    raising DuplicateSectionError.
+    """
+    sections: Dict[str, Dict[str, str]] = {}
+    current: Optional[Dict[str, str]] = None
+    for line in path.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        if line[0] == "[" and line[-1] == "]":
+            current = sections.setdefault(line[1:-1], {})
+        elif current is not None and "=" in line:
+            key, _, value = line.partition("=")
+            current[key.strip().lower()] = value.strip()
+    return sections
+
+
+def read_profiles_ini(base_dir: Path) -> Dict[str, Dict[str, str]]:
     ini = base_dir / "profiles.ini"
     if not ini.is_file():
         raise FileNotFoundError(f"profiles.ini not found at: {ini}")
-    cp = configparser.ConfigParser(interpolation=None)
-    cp.read(ini, encoding="utf-8")
-    return cp
+    return _parse_profiles_ini(ini)
 
 
-def resolve_profile_dir(base_dir: Path, cp: configparser.ConfigParser, section: str) -> Optional[Path]:
-    p = cp.get(section, "Path", fallback=None)
+def resolve_profile_dir(base_dir: Path, section: Dict[str, str]) -> Optional[Path]:
+    p = section.get("path")
     if not p:
         return None
-    is_rel = cp.get(section, "IsRelative", fallback="1") == "1"
+    is_rel = section.get("isrelative", "1") == "1"
     return (base_dir / p) if is_rel else Path(p)
 
 
+def _profile_cache_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(cache_home) / "lw-export" / "profile.path"
+
+
+def _read_cached_profile_dir(ini: Path, stamp: Tuple[int, int]) -> Optional[Path]:
+    # Cache file lines: profiles.ini path, its st_mtime_ns, its st_size, resolved profile dir.
+    # The size catches restores (cp -p, rsync -a) that keep the mtime but change the content.
+    try:
+        cached_ini, cached_mtime, cached_size, cached_dir = (
+            _profile_cache_path().read_text(encoding="utf-8").splitlines()[:4]
+        )
+    except (OSError, ValueError):
+        return None
+    if cached_ini != str(ini) or (cached_mtime, cached_size) != (str(stamp[0]), str(stamp[1])):
+        return None
+    p = Path(cached_dir)
+    return p if (p / "prefs.js").is_file() else None
+
+
+def _write_cached_profile_dir(ini: Path, stamp: Tuple[int, int], profile_dir: Path) -> None:
+    cache = _profile_cache_path()
+    try:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        cache.write_text(f"{ini}\n{stamp[0]}\n{stamp[1]}\n{profile_dir}\n", encoding="utf-8")
+    except OSError:
+        pass  # the cache is only an optimisation
+
+
 def pick_default_profile_dir(base_dir: Path) -> Path:
-    cp = read_profiles_ini(base_dir)
-    profiles = [s for s in cp.sections() if s.lower().startswith("profile")]
-    profiles.sort(key=lambda s: 0 if cp.get(s, "Default", fallback="0") == "1" else 1)
+    ini_path = base_dir / "profiles.ini"
+    try:
+        st = ini_path.stat()
+        stamp: Optional[Tuple[int, int]] = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        stamp = None  # read_profiles_ini reports the missing file
+    if stamp is not None:
+        cached = _read_cached_profile_dir(ini_path, stamp)
+        if cached is not None:
+            return cached
+
+    ini = read_profiles_ini(base_dir)
+    profiles = [s for s in ini if s.lower().startswith("profile")]
+    profiles.sort(key=lambda s: 0 if ini[s].get("default", "0") == "1" else 1)
     for sec in profiles:
-        p = resolve_profile_dir(base_dir, cp, sec)
+        p = resolve_profile_dir(base_dir, ini[sec])
         if p and (p / "prefs.js").is_file():
+            # A fallback pick could go stale once the preferred profile gets a prefs.js.
+            if stamp is not None and sec == profiles[0]:
+                _write_cached_profile_dir(ini_path, stamp, p)
             return p
     raise RuntimeError("No usable profile found")
 
@@ -166,33 +243,182 @@ def autodetect_base_dir() -> Path:
     return Path.home() / ".librewolf"
 
 
-def iter_user_prefs(prefs_js: Path) -> Iterable[Tuple[str, str]]:
-    with prefs_js.open("r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            m = PREF_RE.match(line)
-            if m:
-                yield m.group("name"), m.group("value")
+def iter_user_prefs(prefs_js: Path) -> Iterable[Tuple[str, str, str]]:
+    """Yield (name, name.lower(), value) so filters never re-lowercase the name."""
+    # One read for the whole file. Map \r\n and lone \r to \n like universal-newline
+    # text mode does, so every line ending ends a pref.
+    text = prefs_js.read_bytes().decode("utf-8", "replace")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    for m in PREF_RE.finditer(text):
+        name, value = m.groups()
+        yield name, name.lower(), value
 
 
-def compile_regexes(patterns: List[str]) -> List[re.Pattern]:
+def compile_regexes(patterns: List[str]) -> List[re.Pattern[str]]:
     return [re.compile(p) for p in patterns]
 
 
+def compile_union(patterns: List[str]) -> re.Pattern[str]:
+    """One alternation so a single search replaces one search per pattern."""
+    if not patterns:
+        return re.compile(r"(?!)")  # never matches
+    return re.compile("|".join(f"(?:{p})" for p in patterns))
+
+
+def regex_literal_prefix(pattern: str) -> str:
+    """Static text every match of an anchored pattern starts with ("" if unknown)."""
+    # Walk the parsed pattern rather than its text so classes, groups and
+    # alternations are understood exactly as the regex engine sees them. The
+    # parser is CPython-private: if its shape ever changes, "" is the safe answer
+    # (the regex is then tried for every name and the automaton is disabled).
+    try:
+        return _parsed_literal_prefix(pattern)
+    except Exception:
+        return ""
+
+
+def _parsed_literal_prefix(pattern: str) -> str:
+    parsed = sre_parse.parse(pattern)
+    if parsed.state.flags & re.IGNORECASE:
+        return ""
+    items = list(parsed)
+    if not items or items[0] != (sre_parse.AT, sre_parse.AT_BEGINNING):
+        return ""  # unanchored, or a top-level alternation (BRANCH)
+    out: List[str] = []
+    for op, arg in items[1:]:
+        if op != sre_parse.LITERAL:
+            break
+        out.append(chr(arg))
+    return "".join(out)
+
+
+class Bucket(NamedTuple):
+    prefixes: Tuple[str, ...]
+    exclude_union: re.Pattern[str]
+    include_union: re.Pattern[str]
+
+
+def _dispatch_head(literal: str, exact: bool) -> Optional[str]:
+    # First dot-segment of every name starting with `literal` (or equal to it if exact).
+    if "." in literal:
+        return literal.partition(".")[0]
+    return literal if exact else None
+
+
+def _regex_dispatch_head(pattern: str) -> Optional[str]:
+    lit = regex_literal_prefix(pattern)
+    if not lit:
+        return None  # unparsed, unanchored or alternated: try it for every name
+    return _dispatch_head(lit, pattern == f"^{re.escape(lit)}$")
+
+
+def build_buckets(
+    exclude_prefixes: Iterable[str],
+    exclude_regexes: List[str],
+    include_regexes: List[str],
+) -> Dict[str, Bucket]:
+    """Group prefixes and regexes by the first dot-segment a matching name must have.
+
+    Filters without a derivable head go into every bucket. Names whose head has
+    no bucket of its own use the "" bucket.
+    """
+    groups: Dict[str, Tuple[List[str], List[str], List[str]]] = {"": ([], [], [])}
+    anywhere: Tuple[List[str], List[str], List[str]] = ([], [], [])
+
+    def group(head: Optional[str]) -> Tuple[List[str], List[str], List[str]]:
+        return anywhere if head is None else groups.setdefault(head, ([], [], []))
+
+    for p in exclude_prefixes:
+        group(_dispatch_head(p, exact=False))[0].append(p)
+    for i, regexes in ((1, exclude_regexes), (2, include_regexes)):
+        for p in regexes:
+            group(_regex_dispatch_head(p))[i].append(p)
+    pre_any, exc_any, inc_any = anywhere
+    return {
+        head: Bucket(tuple(pre + pre_any), compile_union(exc + exc_any), compile_union(inc + inc_any))
+        for head, (pre, exc, inc) in groups.items()
+    }
+
+
+# Compiled once per process rather than on every main() call.
+_DEFAULT_EXCLUDE_REGEXES_C = compile_regexes(DEFAULT_EXCLUDE_REGEXES)
+_DEFAULT_INCLUDE_REGEXES_C = compile_regexes(DEFAULT_INCLUDE_REGEXES)
+_DEFAULT_BUCKETS = build_buckets(DEFAULT_EXCLUDE_PREFIXES, DEFAULT_EXCLUDE_REGEXES, DEFAULT_INCLUDE_REGEXES)
+_DEFAULT_SUBSTRING_UNION = compile_union([re.escape(s) for s in DEFAULT_EXCLUDE_SUBSTRINGS])
+
+
+def build_automaton(
+    exclude_prefixes: Iterable[str],
+    exclude_substrings: Iterable[str],
+    exclude_regexes: List[re.Pattern[str]],
+    include_regexes: List[re.Pattern[str]],
+) -> Optional[Any]:
+    """Aho-Corasick automaton over lowercased literals, or None to use the linear scans.
+
+    Each key maps to (len(key), [(kind, pattern), ...]). Prefixes and regex
+    literal heads only count when the hit is anchored at the start of the name
+    and are then verified case-sensitively.
+    """
+    if ahocorasick is None:
+        return None
+    entries: Dict[str, List[Tuple[str, Any]]] = {}
+    for p in exclude_prefixes:
+        entries.setdefault(p.lower(), []).append(("prefix", p))
+    for s in exclude_substrings:
+        entries.setdefault(s.lower(), []).append(("substring", s))
+    for kind, regexes in (("exclude_regex", exclude_regexes), ("include_regex", include_regexes)):
+        for r in regexes:
+            head = regex_literal_prefix(r.pattern)
+            if not head:
+                return None
+            entries.setdefault(head.lower(), []).append((kind, r))
+    automaton = ahocorasick.Automaton()
+    for key, kinds in entries.items():
+        automaton.add_word(key, (len(key), kinds))
+    automaton.make_automaton()
+    return automaton
+
+
 def should_exclude(
     name: str,
-    exclude_prefixes: List[str],
-    exclude_substrings: List[str],
-    exclude_regexes: List[re.Pattern],
-    include_regexes: List[re.Pattern],
+    name_lower: str,
+    buckets: Dict[str, Bucket],
+    substring_union: re.Pattern[str],
+    automaton: Optional[Any] = None,
 ) -> bool:
-    if any(r.search(name) for r in exclude_regexes):
+    if automaton is not None:
+        return _should_exclude_automaton(name, name_lower, automaton)
+    # Only filters that can match this name's first dot-segment are tried.
+    bucket = buckets.get(name.partition(".")[0]) or buckets[""]
+    if bucket.exclude_union.search(name):
         return True
-    if any(r.search(name) for r in include_regexes):
+    if bucket.include_union.search(name):
         return False
-    if any(name.startswith(p) for p in exclude_prefixes):
+    if name.startswith(bucket.prefixes):
         return True
-    n = name.lower()
-    return any(s in n for s in exclude_substrings)
+    return substring_union.search(name_lower) is not None
+
+
+def _should_exclude_automaton(name: str, name_lower: str, automaton: Any) -> bool:
+    # Same precedence as the linear scans: exclude regex > include regex > prefix/substring.
+    prefix_hit = substring_hit = include_hit = False
+    for end, (key_len, kinds) in automaton.iter(name_lower):
+        anchored = end == key_len - 1
+        for kind, pattern in kinds:
+            if kind == "substring":
+                substring_hit = True
+            elif not anchored:
+                continue
+            elif kind == "prefix":
+                prefix_hit = prefix_hit or name.startswith(pattern)
+            elif pattern.search(name):
+                if kind == "exclude_regex":
+                    return True
+                include_hit = True
+    if include_hit:
+        return False
+    return prefix_hit or substring_hit
 
 
 def write_overrides(prefs: Iterable[Tuple[str, str]], out_path: Path) -> None:
@@ -203,13 +429,27 @@ def write_overrides(prefs: Iterable[Tuple[str, str]], out_path: Path) -> None:
         " * Policy-only, privacy-first: no IDs, timestamps, counters, UI state, or font pinning\n"
         " */"
     )
-    with out_path.open("w", encoding="utf-8", newline="\n") as f:
-        f.write(header + "\n\n")
-        for name, value in prefs:
-            f.write(f'pref("{name}", {value});\n')
+    # prefs may be a lazy parse/filter stream: write beside the real target and swap it in
+    # only once complete, so a failure mid-stream never leaves a truncated config behind.
+    # Resolving first keeps a symlinked config a symlink and updates the file it points to.
+    target = out_path.resolve()
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    try:
+        with tmp_path.open("w", encoding="utf-8", newline="\n") as f:
+            f.write(header + "\n\n")
+            f.writelines(f'pref("{name}", {value});\n' for name, value in prefs)
+        if target.exists():
+            shutil.copymode(target, tmp_path)  # don't widen e.g. a 0640 config
+        os.replace(tmp_path, target)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
 
 
 def main() -> int:
+    import argparse  # only needed when run as a CLI
+
     ap = argparse.ArgumentParser(description="Export LibreWolf policy prefs to librewolf.overrides.cfg (privacy-first)")
     ap.add_argument("--base-dir", type=Path)
     ap.add_argument("--profile-dir", type=Path)
@@ -225,29 +465,38 @@ def main() -> int:
 
     out_path = args.output or (base_dir / "librewolf.overrides.cfg")
 
-    exclude_prefixes = DEFAULT_EXCLUDE_PREFIXES
-    exclude_substrings = DEFAULT_EXCLUDE_SUBSTRINGS
-    exclude_regexes = compile_regexes(DEFAULT_EXCLUDE_REGEXES)
-    include_regexes = compile_regexes(DEFAULT_INCLUDE_REGEXES)
+    buckets = _DEFAULT_BUCKETS
+    substring_union = _DEFAULT_SUBSTRING_UNION
+    automaton = build_automaton(
+        DEFAULT_EXCLUDE_PREFIXES, DEFAULT_EXCLUDE_SUBSTRINGS, _DEFAULT_EXCLUDE_REGEXES_C, _DEFAULT_INCLUDE_REGEXES_C,
+    )
+
+    # Stream parse -> filter -> write; only skipped prefs are kept, and only for the audit.
+    read_count = dropped_count = 0
+    skipped: List[Tuple[str, str]] = []
 
-    kept, dropped = [], []
-    for name, value in iter_user_prefs(prefs_js):
-        if should_exclude(name, exclude_prefixes, exclude_substrings, exclude_regexes, include_regexes):
-            dropped.append((name, value))
-        else:
-            kept.append((name, value))
+    def kept() -> Iterator[Tuple[str, str]]:
+        nonlocal read_count, dropped_count
+        for name, name_lower, value in iter_user_prefs(prefs_js):
+            read_count += 1
+            if should_exclude(name, name_lower, buckets, substring_union, automaton):
+                dropped_count += 1
+                if args.print_skipped:
+                    skipped.append((name, value))
+            else:
+                yield name, value
 
-    write_overrides(kept, out_path)
+    write_overrides(kept(), out_path)
 
     print(f"Profile:  {profile_dir}")
-    print(f"Read:     {len(kept) + len(dropped)} prefs")
-    print(f"Written:  {len(kept)} prefs")
-    print(f"Skipped:  {len(dropped)} prefs")
+    print(f"Read:     {read_count} prefs")
+    print(f"Written:  {read_count - dropped_count} prefs")
+    print(f"Skipped:  {dropped_count} prefs")
     print(f"Output:   {out_path}")
 
     if args.print_skipped:
         print("\n# --- skipped prefs (audit) ---")
-        for n, v in dropped:
+        for n, v in skipped:
             print(f'# user_pref("{n}", {v});')
 
     return 0
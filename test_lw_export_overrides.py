@@ -0,0 +1,277 @@
+import os
+import re
+
+import pytest
+
+import lw_export_overrides as lw
+
+
+def reference_exclude(name, prefixes, substrings, exclude_regexes, include_regexes):
+    # Plain per-filter scan: the behaviour every fast path must reproduce.
+    if any(re.search(p, name) for p in exclude_regexes):
+        return True
+    if any(re.search(p, name) for p in include_regexes):
+        return False
+    if any(name.startswith(p) for p in prefixes):
+        return True
+    n = name.lower()
+    return any(s in n for s in substrings)
+
+
+def classifiers(prefixes, substrings, exclude_regexes, include_regexes):
+    buckets = lw.build_buckets(prefixes, exclude_regexes, include_regexes)
+    union = lw.compile_union([re.escape(s) for s in substrings])
+    yield "buckets", lambda name: lw.should_exclude(name, name.lower(), buckets, union)
+    automaton = lw.build_automaton(
+        prefixes, substrings, lw.compile_regexes(exclude_regexes), lw.compile_regexes(include_regexes),
+    )
+    if automaton is not None:
+        yield "automaton", lambda name: lw.should_exclude(name, name.lower(), buckets, union, automaton)
+
+
+def sample_names(literals):
+    names = {"", "a", "zzz.bar", "foo", "foo.x", "bar.baz"}
+    for lit in literals:
+        for tail in ("", "x", "enabled", "foo.Bar", "last_purge", "tls.x", "date_in_cookie_database"):
+            names.update({lit + tail, lit.upper() + tail, "zzz." + lit + tail})
+    return sorted(names)
+
+
+def assert_parity(prefixes, substrings, exclude_regexes, include_regexes, names):
+    for label, classify in classifiers(prefixes, substrings, exclude_regexes, include_regexes):
+        for name in names:
+            expected = reference_exclude(name, prefixes, substrings, exclude_regexes, include_regexes)
+            assert classify(name) == expected, (label, name)
+
+
+@pytest.mark.parametrize(
+    ("pattern", "head"),
+    [
+        (r"^media\.gmp-", "media.gmp-"),
+        (r"^security\.(tls\.|ssl\.|ocsp\.)", "security."),
+        (r"^print_printer$", "print_printer"),
+        (r"^ab?c", "a"),
+        (r"^a|b", ""),
+        (r"^foo[)]x|bar", ""),
+        (r"(?i)^abc", ""),
+        (r"abc", ""),
+    ],
+)
+def test_regex_literal_prefix(pattern, head):
+    assert lw.regex_literal_prefix(pattern) == head
+
+
+@pytest.mark.parametrize(
+    "broken_parser",
+    [None, type("NoState", (), {"parse": staticmethod(lambda p: [])}), type("Boom", (), {"parse": staticmethod(len)})],
+)
+def test_regex_literal_prefix_survives_parser_changes(monkeypatch, broken_parser):
+    monkeypatch.setattr(lw, "sre_parse", broken_parser)
+    assert lw.regex_literal_prefix(r"^media\.gmp-") == ""
+    buckets = lw.build_buckets([], [r"^media\.gmp-"], [])
+    assert all("gmp" in b.exclude_union.pattern for b in buckets.values())
+
+
+def test_default_filters_agree_with_plain_scan():
+    literals = list(lw.DEFAULT_EXCLUDE_PREFIXES) + list(lw.DEFAULT_EXCLUDE_SUBSTRINGS)
+    literals += [lw.regex_literal_prefix(p) for p in lw.DEFAULT_EXCLUDE_REGEXES + lw.DEFAULT_INCLUDE_REGEXES]
+    assert_parity(
+        lw.DEFAULT_EXCLUDE_PREFIXES,
+        lw.DEFAULT_EXCLUDE_SUBSTRINGS,
+        lw.DEFAULT_EXCLUDE_REGEXES,
+        lw.DEFAULT_INCLUDE_REGEXES,
+        sample_names(literals),
+    )
+
+
+def test_top_level_alternation_is_never_narrowed():
+    exclude_regexes = [r"^foo\.[)]x|bar"]
+    assert_parity(["foo."], ["zz"], exclude_regexes, [r"^keep\."], sample_names(["foo.", "keep.", "bar"]))
+
+
+def test_regex_without_safe_head_lands_in_every_bucket():
+    buckets = lw.build_buckets(["x.y."], [r"^foo\.[)]x|bar", r"^$"], [r"^(?i:keep)\."])
+    for bucket in buckets.values():
+        assert "bar" in bucket.exclude_union.pattern
+        assert "^$" in bucket.exclude_union.pattern
+        assert "keep" in bucket.include_union.pattern
+    union = lw.compile_union(["zz"])
+    assert lw.should_exclude("zzz.bar", "zzz.bar", buckets, union)
+    assert lw.should_exclude("", "", buckets, union)
+    assert not lw.should_exclude("KEEP.x.zz", "keep.x.zz", buckets, union)
+
+
+def test_write_overrides_keeps_old_file_when_stream_fails(tmp_path):
+    out = tmp_path / "librewolf.overrides.cfg"
+    out.write_text("OLD CONTENT\n", encoding="utf-8")
+
+    def failing_prefs():
+        for i in range(100):
+            yield f"p{i}", "true"
+        raise OSError("read error")
+
+    with pytest.raises(OSError):
+        lw.write_overrides(failing_prefs(), out)
+    assert out.read_text(encoding="utf-8") == "OLD CONTENT\n"
+    assert list(tmp_path.iterdir()) == [out]
+
+    lw.write_overrides(iter([("a.b", "true")]), out)
+    assert out.read_text(encoding="utf-8").endswith('pref("a.b", true);\n')
+    assert list(tmp_path.iterdir()) == [out]
+
+
+def test_write_overrides_writes_through_symlink_and_keeps_mode(tmp_path):
+    real = tmp_path / "dotfiles" / "real.cfg"
+    real.parent.mkdir()
+    real.write_text("OLD CONTENT\n", encoding="utf-8")
+    os.chmod(real, 0o640)
+    link = tmp_path / "profile" / "librewolf.overrides.cfg"
+    link.parent.mkdir()
+    link.symlink_to(real)
+
+    lw.write_overrides(iter([("a.b", "true")]), link)
+
+    assert link.is_symlink()
+    assert real.read_text(encoding="utf-8").endswith('pref("a.b", true);\n')
+    assert real.stat().st_mode & 0o777 == 0o640
+    assert sorted(p.name for p in real.parent.iterdir()) == ["real.cfg"]
+
+
+def parse(tmp_path, data):
+    prefs_js = tmp_path / "prefs.js"
+    prefs_js.write_bytes(data)
+    return [(name, value) for name, _, value in lw.iter_user_prefs(prefs_js)]
+
+
+@pytest.mark.parametrize("eol", [b"\n", b"\r\n", b"\r"])
+def test_iter_user_prefs_line_endings(tmp_path, eol):
+    data = eol.join([b'user_pref("a.b", true);', b'  user_pref("c", "x y");  ', b""])
+    assert parse(tmp_path, data) == [("a.b", "true"), ("c", '"x y"')]
+
+
+def test_iter_user_prefs_skips_comments_and_split_lines(tmp_path):
+    data = (
+        b"// Mozilla User Preferences\n"
+        b"/* user_pref(\"in.block\", 1); */\n"
+        b'// user_pref("commented", 1);\n'
+        b'user_pref("split",\n1);\n'
+        b'user_pref("kept", 2);\n'
+    )
+    assert parse(tmp_path, data) == [("kept", "2")]
+
+
+def test_iter_user_prefs_accepts_baseline_whitespace(tmp_path):
+    data = '\fuser_pref("a", 1);\x0b\nuser_pref("b",\t2\xa0);\xa0\n'.encode("utf-8")
+    assert parse(tmp_path, data) == [("a", "1"), ("b", "2")]
+
+
+def test_iter_user_prefs_empty_file(tmp_path):
+    assert parse(tmp_path, b"") == []
+
+
+def make_profile(base, name, prefs=True):
+    d = base / name
+    d.mkdir()
+    if prefs:
+        (d / "prefs.js").write_text('user_pref("a", 1);\n', encoding="utf-8")
+    return d
+
+
+def write_ini(base, *sections):
+    ini = base / "profiles.ini"
+    ini.write_text("\n\n".join(sections) + "\n", encoding="utf-8")
+    return ini
+
+
+@pytest.fixture
+def cache_home(tmp_path, monkeypatch):
+    home = tmp_path / "cache"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(home))
+    return home / "lw-export" / "profile.path"
+
+
+@pytest.fixture
+def base(tmp_path):
+    d = tmp_path / "librewolf"
+    d.mkdir()
+    return d
+
+
+def test_profile_cache_hit_skips_profiles_ini(base, cache_home, monkeypatch):
+    prof = make_profile(base, "a.default")
+    write_ini(base, "[Profile0]\nPath=a.default\nIsRelative=1\nDefault=1")
+    assert lw.pick_default_profile_dir(base) == prof
+    assert cache_home.is_file()
+
+    monkeypatch.setattr(lw, "read_profiles_ini", None)  # a hit must not parse the ini
+    assert lw.pick_default_profile_dir(base) == prof
+
+
+def test_profile_cache_miss_when_ini_changes(base, cache_home):
+    make_profile(base, "a.default")
+    b = make_profile(base, "b.default")
+    ini = write_ini(base, "[Profile0]\nPath=a.default\nDefault=1")
+    lw.pick_default_profile_dir(base)
+
+    st = ini.stat()
+    write_ini(base, "[Profile0]\nPath=b.default\nDefault=1")
+    os.utime(ini, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert lw.pick_default_profile_dir(base) == b
+
+
+def test_profile_cache_miss_when_size_changes_under_same_mtime(base, cache_home):
+    make_profile(base, "a.default")
+    bb = make_profile(base, "bb.default")
+    ini = write_ini(base, "[Profile0]\nPath=a.default\nDefault=1")
+    lw.pick_default_profile_dir(base)
+
+    st = ini.stat()
+    write_ini(base, "[Profile0]\nPath=bb.default\nDefault=1")
+    os.utime(ini, ns=(st.st_atime_ns, st.st_mtime_ns))  # e.g. restored with cp -p
+    assert lw.pick_default_profile_dir(base) == bb
+
+
+def test_profile_cache_miss_when_cached_dir_lost_prefs(base, cache_home):
+    a = make_profile(base, "a.default")
+    b = make_profile(base, "b.default")
+    write_ini(base, "[Profile0]\nPath=a.default\nDefault=1", "[Profile1]\nPath=b.default")
+    assert lw.pick_default_profile_dir(base) == a
+
+    (a / "prefs.js").unlink()
+    assert lw.pick_default_profile_dir(base) == b
+
+
+def test_profile_cache_not_written_for_fallback_pick(base, cache_home):
+    make_profile(base, "a.default", prefs=False)
+    b = make_profile(base, "b.default")
+    write_ini(base, "[Profile0]\nPath=a.default\nDefault=1", "[Profile1]\nPath=b.default")
+    assert lw.pick_default_profile_dir(base) == b
+    assert not cache_home.exists()
+
+
+@pytest.mark.parametrize("content", [b"", b"only-one-line\n", b"\xff\xfe\x00garbage", b"a\nb\nc\nd\n"])
+def test_profile_cache_corrupt_file_is_a_miss(base, cache_home, content):
+    a = make_profile(base, "a.default")
+    write_ini(base, "[Profile0]\nPath=a.default\nDefault=1")
+    cache_home.parent.mkdir(parents=True)
+    cache_home.write_bytes(content)
+    assert lw.pick_default_profile_dir(base) == a
+    assert cache_home.read_text(encoding="utf-8").splitlines()[-1] == str(a)
+
+
+def test_pick_default_profile_dir_real_profiles_ini_layout(base, cache_home, tmp_path):
+    make_profile(base, "abc123.default-release")
+    chosen = make_profile(base, "xyz789.default")
+    absolute = make_profile(tmp_path, "elsewhere")
+    write_ini(
+        base,
+        "[Install4F96D1932A9F858E]\nDefault=abc123.default-release\nLocked=1",
+        "[Profile2]\nName=other\nIsRelative=0\nPath=" + str(absolute),
+        "[Profile1]\nName=default\nIsRelative=1\nPath=xyz789.default\nDefault=1",
+        "[Profile0]\nName=default-release\nIsRelative=1\nPath=abc123.default-release",
+        "[General]\nStartWithLastProfile=1\nVersion=2",
+    )
+    ini = lw.read_profiles_ini(base)
+    assert ini["Profile1"] == {"name": "default", "isrelative": "1", "path": "xyz789.default", "default": "1"}
+    assert lw.resolve_profile_dir(base, ini["Profile2"]) == absolute
+    assert lw.pick_default_profile_dir(base) == chosen